@@ -173,8 +173,19 @@ echo "📦 Installing Python packages..."
 sudo -u ubuntu bash -c "
 source /home/ubuntu/transcription-env/bin/activate
 pip install --upgrade pip setuptools wheel
-pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
-pip install openai-whisper google-api-python-client google-auth google-cloud-storage tqdm certifi
+pip install faster-whisper==1.1.1 nvidia-cublas-cu12 'nvidia-cudnn-cu12==9.*'
+pip install google-api-python-client google-auth 'google-cloud-storage>=2.14' tqdm certifi orjson
+"
+
+# CTranslate2 4.x loads CUDA 12 cuBLAS/cuDNN 9 from the pip wheels above
+NVIDIA_LIBS=/home/ubuntu/transcription-env/lib/python3.12/site-packages/nvidia
+echo "export LD_LIBRARY_PATH=$NVIDIA_LIBS/cublas/lib:$NVIDIA_LIBS/cudnn/lib:\${LD_LIBRARY_PATH}" >> /home/ubuntu/transcription-env/bin/activate
+
+# Bake the Whisper model into the AMI so Spot launches skip the download
+echo "🤖 Pre-downloading Whisper model..."
+sudo -u ubuntu bash -c "
+source /home/ubuntu/transcription-env/bin/activate
+python -c 'import faster_whisper; faster_whisper.download_model(\"medium\", cache_dir=\"/home/ubuntu/whisper-cache\")'
 "
 
 # Install NVIDIA drivers
@@ -207,7 +218,7 @@ else
 fi
 
 # Test CUDA availability
-echo "CUDA Available: $(python -c 'import torch; print(torch.cuda.is_available())' 2>/dev/null || echo 'Will be available after environment activation')"
+echo "CUDA Available: $(python -c 'import ctranslate2; print(ctranslate2.get_cuda_device_count() > 0)' 2>/dev/null || echo 'Will be available after environment activation')"
 echo ""
 ACTIVATE
 
@@ -291,13 +302,14 @@ source /home/ubuntu/transcription-env/bin/activate
 echo 'Testing FFmpeg:'
 ffmpeg -version | head -1
 echo 'Testing Python packages:'
-python -c 'import whisper; print(\"✅ Whisper:\", whisper.__version__)'
-python -c 'import torch; print(\"✅ PyTorch:\", torch.__version__)'
+python -c 'import faster_whisper; print(\"✅ faster-whisper:\", faster_whisper.__version__)'
+python -c 'import ctranslate2; print(\"✅ CTranslate2:\", ctranslate2.__version__)'
 python -c 'import google.cloud.storage; print(\"✅ Google Cloud Storage: OK\")'
 python -c 'import google.auth; print(\"✅ Google Auth: OK\")'
 python -c 'import tqdm; print(\"✅ TQDM: OK\")'
+python -c 'import orjson; print(\"✅ orjson: OK\")'
 echo 'Testing CUDA availability (will show after reboot):'
-python -c 'import torch; print(\"CUDA available:\", torch.cuda.is_available())'
+python -c 'import ctranslate2; print(\"CUDA available:\", ctranslate2.get_cuda_device_count() > 0)'
 "
 
 # Clean up to reduce AMI size
@@ -345,7 +357,7 @@ echo 'Checking fast deployment template:'
 ls -la fast-deployment-template.sh 2>/dev/null || echo 'Fast deployment template not found'
 
 echo 'Testing basic imports:'
-source transcription-env/bin/activate 2>/dev/null && python -c 'import whisper, torch; print(\"Basic imports successful\")' 2>/dev/null || echo 'Import test failed'
+source transcription-env/bin/activate 2>/dev/null && python -c 'import faster_whisper, ctranslate2; print(\"Basic imports successful\")' 2>/dev/null || echo 'Import test failed'
 "
 
 echo "✅ Setup completed on instance"
@@ -25,15 +25,25 @@ Reuses AWS Spot Fleet infrastructure from podcast transcription project
 """
 
 import os
-import json
+import sys
+import gc
+import queue
+import io
 import time
 import re
+import html
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
-import whisper
+import orjson
+import ctranslate2
+from faster_whisper import WhisperModel, decode_audio
 from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 from google.cloud import storage
 import certifi
 import subprocess
@@ -43,7 +53,16 @@ os.environ['SSL_CERT_FILE'] = certifi.where()
 # ===== CONFIGURATION =====
 CREDENTIALS_FILE = "../config/credentials.json"
 WHISPER_MODEL = "medium"  # Pre-configured for balance of speed/quality
-TEMP_AUDIO_DIR = Path("./temp_audio")
+WHISPER_CACHE_DIR = os.environ.get("WHISPER_CACHE_DIR", str(Path.home() / "whisper-cache"))  # Pre-populated in the AMI
+GPU_MODELS = ("medium", "large")  # Models that should run on a GPU instance
+WHISPER_DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+COMPUTE_TYPE = "int8_float16" if WHISPER_DEVICE == "cuda" else "int8"  # INT8 weights halve memory
+VAD_MIN_SILENCE_MS = 500  # Silero VAD drops silences longer than this before decoding
+BEAM_SIZE = 5  # Beams are batched in CTranslate2, so this costs little over greedy
+METADATA_WORKERS = 16  # Parallel GCS reads when checking existing metadata
+TRANSCRIBE_WORKERS = 2 if WHISPER_DEVICE == "cuda" else 1  # Concurrent files per GPU (~2 GB VRAM each for medium)
+MAX_PREFETCH = 2 * TRANSCRIBE_WORKERS  # Files downloaded or transcribing at once (bounds decoded audio in RAM)
+HTTP_POOL_SIZE = 20  # Reused TLS connections to GCS (>= METADATA_WORKERS)
 
 # Google Cloud Storage Configuration (NEW BUCKET FOR YOUR FILES)
 GCS_PROJECT_ID = "podcast-transcription-462218"
@@ -57,7 +76,6 @@ CUSTOM_FOLDER_NAME = "Custom Audio Transcripts"  # NEW: Separate folder for your
 
 SCOPES = [
     "https://www.googleapis.com/auth/drive",
-    "https://www.googleapis.com/auth/documents",
     "https://www.googleapis.com/auth/cloud-platform"
 ]
 
@@ -67,9 +85,13 @@ def authenticate():
     creds = service_account.Credentials.from_service_account_file(
         CREDENTIALS_FILE, scopes=SCOPES)
     drive_service = build('drive', 'v3', credentials=creds)
-    docs_service = build('docs', 'v1', credentials=creds)
-    gcs_client = storage.Client(credentials=creds, project=GCS_PROJECT_ID)
-    return drive_service, docs_service, gcs_client
+    
+    # GCS gets a pooled session sized for the parallel metadata reads
+    gcs_session = AuthorizedSession(creds)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    gcs_session.mount("https://", adapter)
+    gcs_client = storage.Client(credentials=creds, project=GCS_PROJECT_ID, _http=gcs_session)
+    return drive_service, gcs_client
 
 # ===== SETUP FUNCTIONS =====
 def setup_gcs_bucket(gcs_client):
@@ -107,136 +129,177 @@ def setup_drive_folder(drive_service):
 def get_audio_files_from_gcs(gcs_client):
     """Get list of .m4a files from GCS bucket"""
     bucket = gcs_client.bucket(GCS_BUCKET_NAME)
-    blobs = list(bucket.list_blobs(prefix=GCS_AUDIO_PREFIX))
-    
-    audio_files = []
-    for blob in blobs:
-        if blob.name.endswith('.m4a'):
-            filename = Path(blob.name).name
-            audio_files.append({
-                'filename': filename,
-                'gcs_path': blob.name,
-                'size_mb': blob.size / (1024 * 1024)
-            })
-    
-    return audio_files
-
-def download_audio_file(gcs_client, gcs_path, local_path):
-    """Download audio file from GCS to local temp directory"""
+    # Filter server-side so non-audio blobs are never listed
+    blobs = bucket.list_blobs(match_glob=f"{GCS_AUDIO_PREFIX}**.m4a")
+    
+    return [{
+        'filename': blob.name.rsplit('/', 1)[-1],
+        'gcs_path': blob.name,
+        'size_mb': blob.size / (1024 * 1024)
+    } for blob in blobs]
+
+def download_audio(gcs_client, gcs_path):
+    """Download audio from GCS and decode it in memory (16 kHz mono float32)"""
     bucket = gcs_client.bucket(GCS_BUCKET_NAME)
     blob = bucket.blob(gcs_path)
     
-    # Ensure temp directory exists
-    local_path.parent.mkdir(parents=True, exist_ok=True)
-    
     print(f"📥 Downloading {Path(gcs_path).name}...")
-    blob.download_to_filename(str(local_path))
-    return local_path
+    raw = blob.download_as_bytes()
+    # BytesIO stays seekable, so .m4a files with a trailing moov atom still decode
+    return decode_audio(io.BytesIO(raw))
 
 # ===== METADATA HANDLING =====
+def get_metadata_path(filename):
+    """GCS path of the metadata JSON for an audio file"""
+    return f"{GCS_METADATA_PREFIX}{Path(filename).stem}.json"
+
+def new_metadata(filename):
+    """Create fresh metadata for a file that has not been processed yet"""
+    return {
+        'filename': filename,
+        'title': Path(filename).stem,
+        'gcs_path': f"{GCS_AUDIO_PREFIX}{filename}",
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'status': 'pending'
+    }
+
 def load_metadata(gcs_client, filename):
     """Load existing metadata from GCS"""
-    metadata_filename = f"{Path(filename).stem}.json"
-    metadata_path = f"{GCS_METADATA_PREFIX}{metadata_filename}"
-    
     try:
         bucket = gcs_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(metadata_path)
-        metadata_json = blob.download_as_text()
-        return json.loads(metadata_json)
+        blob = bucket.blob(get_metadata_path(filename))
+        return orjson.loads(blob.download_as_bytes())
     except Exception:
-        # Create new metadata
-        return {
-            'filename': filename,
-            'title': Path(filename).stem,
-            'gcs_path': f"{GCS_AUDIO_PREFIX}{filename}",
-            'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
-            'status': 'pending'
-        }
+        return new_metadata(filename)
+
+def load_all_metadata(gcs_client, audio_files):
+    """Load metadata for all files with one listing and parallel reads"""
+    bucket = gcs_client.bucket(GCS_BUCKET_NAME)
+    existing = {blob.name for blob in bucket.list_blobs(prefix=GCS_METADATA_PREFIX)}
+    
+    def load(file_info):
+        # Only files with a metadata blob cost a GET
+        if get_metadata_path(file_info['filename']) in existing:
+            return load_metadata(gcs_client, file_info['filename'])
+        return new_metadata(file_info['filename'])
+    
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        metadata_list = list(executor.map(load, audio_files))
+    
+    return {f['filename']: m for f, m in zip(audio_files, metadata_list)}
 
 def save_metadata(gcs_client, metadata):
     """Save metadata to GCS"""
-    metadata_filename = f"{Path(metadata['filename']).stem}.json"
-    metadata_path = f"{GCS_METADATA_PREFIX}{metadata_filename}"
+    metadata_path = get_metadata_path(metadata['filename'])
     
     bucket = gcs_client.bucket(GCS_BUCKET_NAME)
     blob = bucket.blob(metadata_path)
-    blob.upload_from_string(json.dumps(metadata, indent=2))
+    blob.upload_from_string(
+        orjson.dumps(metadata, option=orjson.OPT_INDENT_2),
+        content_type="application/json"
+    )
 
 # ===== GOOGLE DOCS CREATION =====
-def create_google_doc(docs_service, drive_service, folder_id, metadata, transcript):
-    """Create formatted Google Doc with transcript"""
-    # Create document
+def create_google_doc(drive_service, folder_id, metadata, transcript):
+    """Create formatted Google Doc with transcript in a single Drive upload"""
     doc_title = f"{metadata['title']} - Transcript"
-    doc = docs_service.documents().create(body={'title': doc_title}).execute()
-    doc_id = doc['documentId']
-    
-    # Move to correct folder
-    drive_service.files().update(
-        fileId=doc_id,
-        addParents=folder_id,
-        removeParents='root'
-    ).execute()
     
-    # Format content
-    header = f"""TRANSCRIPT: {metadata['title']}
-Generated: {metadata.get('transcribed_at', 'Unknown')}
-Model: {metadata.get('whisper_model', 'Unknown')}
-Duration: {metadata.get('duration_minutes', 'Unknown'):.1f} minutes
-
-{'='*50}
-
-"""
+    # Format content as HTML so Drive's import keeps the heading and bold labels
+    details = [
+        ("Generated:", metadata.get('transcribed_at', 'Unknown')),
+        ("Model:", metadata.get('whisper_model', 'Unknown')),
+        ("Duration:", f"{metadata.get('duration_minutes', 'Unknown'):.1f} minutes"),
+    ]
+    content = (
+        '<meta charset="utf-8">'
+        f"<h1>TRANSCRIPT: {html.escape(metadata['title'])}</h1>"
+        + "".join(f"<p><b>{label}</b> {html.escape(str(value))}</p>" for label, value in details)
+        + f"<p></p><p>{html.escape(transcript)}</p>"
+    )
     
-    content = header + transcript
-    
-    # Insert content
-    requests = [{
-        'insertText': {
-            'location': {'index': 1},
-            'text': content
-        }
-    }]
-    
-    docs_service.documents().batchUpdate(
-        documentId=doc_id,
-        body={'requests': requests}
+    # Create, place in folder and fill the Doc in one request
+    media = MediaIoBaseUpload(
+        io.BytesIO(content.encode('utf-8')),
+        mimetype='text/html; charset=utf-8',
+        resumable=False
+    )
+    doc = drive_service.files().create(
+        body={
+            'name': doc_title,
+            'parents': [folder_id],
+            'mimeType': 'application/vnd.google-apps.document'
+        },
+        media_body=media,
+        fields='id,webViewLink'
     ).execute()
     
-    doc_url = f"https://docs.google.com/document/d/{doc_id}"
+    doc_id = doc['id']
+    doc_url = doc['webViewLink']
     print(f"📄 Created Google Doc: {doc_title}")
     print(f"🔗 URL: {doc_url}")
     
     return doc_id, doc_url
 
 # ===== TRANSCRIPTION =====
-def transcribe_audio(audio_path, metadata):
-    """Transcribe audio file using Whisper"""
-    print(f"🤖 Loading Whisper model: {WHISPER_MODEL}")
-    model = whisper.load_model(WHISPER_MODEL)
+def load_whisper_model():
+    """Load the faster-whisper model once for the whole run"""
+    print(f"🤖 Loading Whisper model: {WHISPER_MODEL} ({WHISPER_DEVICE}, {COMPUTE_TYPE})")
+    return WhisperModel(
+        WHISPER_MODEL,
+        device=WHISPER_DEVICE,
+        compute_type=COMPUTE_TYPE,
+        cpu_threads=max(1, (os.cpu_count() or 1) // TRANSCRIBE_WORKERS),
+        num_workers=TRANSCRIBE_WORKERS,
+        download_root=WHISPER_CACHE_DIR
+    )
+
+# One terminal line per transcription worker so concurrent progress bars don't overwrite each other
+progress_slots = queue.SimpleQueue()
+for slot in range(TRANSCRIBE_WORKERS):
+    progress_slots.put(slot)
+
+def transcribe_audio(model, audio, metadata):
+    """Transcribe audio file using faster-whisper (CTranslate2)"""
+    # tqdm.write keeps log lines above any active progress bars
+    tqdm.write(f"🎙️ Transcribing: {metadata['title']}")
     
-    print(f"🎙️ Transcribing: {metadata['title']}")
+    start_time = time.time()
+    segments_iter, info = model.transcribe(
+        audio,
+        beam_size=BEAM_SIZE,
+        best_of=BEAM_SIZE,
+        patience=1.0,
+        condition_on_previous_text=True,
+        vad_filter=True,
+        vad_parameters=dict(min_silence_duration_ms=VAD_MIN_SILENCE_MS)
+    )
     
-    # Get duration
-    audio = whisper.load_audio(str(audio_path))
-    duration_seconds = len(audio) / whisper.audio.SAMPLE_RATE
-    duration_minutes = duration_seconds / 60
+    # Duration comes from the decoder's own pass over the file
+    duration_minutes = info.duration / 60
+    vad_trimmed_seconds = info.duration - info.duration_after_vad
+    tqdm.write(f"📏 {metadata['title']}: {duration_minutes:.1f} minutes "
+               f"({vad_trimmed_seconds / 60:.1f} minutes of silence skipped)")
     
-    print(f"📏 Duration: {duration_minutes:.1f} minutes")
-    print(f"⏱️ Estimated time: {duration_minutes * 0.5:.1f} minutes")
+    # Segments are yielded lazily as they are decoded, so they drive the progress bar.
+    # Stored column-wise so keys aren't repeated for every segment
+    segments = {"start": [], "end": [], "text": [], "avg_logprob": []}
+    slot = progress_slots.get()
+    try:
+        with tqdm(total=round(info.duration, 1), unit="s", desc=f"🎙️ {metadata['title']}",
+                  position=slot, leave=False,
+                  bar_format="{l_bar}{bar}| {n:.0f}/{total:.0f}s [{elapsed}<{remaining}]") as pbar:
+            for s in segments_iter:
+                segments["start"].append(s.start)
+                segments["end"].append(s.end)
+                segments["text"].append(s.text)
+                segments["avg_logprob"].append(s.avg_logprob)
+                pbar.update(min(s.end, pbar.total) - pbar.n)
+    finally:
+        progress_slots.put(slot)
+    transcript = "".join(segments["text"]).strip()  # Segment texts carry their own leading space
     
-    # Transcribe with progress bar
-    with tqdm(total=100, desc=f"🎙️ Transcribing", 
-              bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]") as pbar:
-        
-        start_time = time.time()
-        result = model.transcribe(str(audio_path), verbose=False)
-        transcript = result["text"].strip()
-        segments = result["segments"]
-        pbar.update(100)
-        
-        elapsed_time = time.time() - start_time
-        print(f"✅ Completed in {elapsed_time / 60:.1f} minutes")
+    elapsed_time = time.time() - start_time
+    tqdm.write(f"✅ Transcribed {metadata['title']} in {elapsed_time / 60:.1f} minutes")
     
     # Update metadata
     metadata.update({
@@ -245,35 +308,109 @@ def transcribe_audio(audio_path, metadata):
         "whisper_model": WHISPER_MODEL,
         "transcribed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
         "duration_minutes": duration_minutes,
+        "vad_trimmed_seconds": vad_trimmed_seconds,
         "processing_time_minutes": elapsed_time / 60,
         "status": "transcribed"
     })
     
     return transcript
 
+# ===== PIPELINE =====
+def publish_transcript(drive_service, gcs_client, folder_id, metadata, transcript):
+    """Create the Google Doc and save final metadata"""
+    doc_id, doc_url = create_google_doc(
+        drive_service, folder_id, metadata, transcript
+    )
+    
+    # Update metadata with doc info
+    metadata.update({
+        'google_doc_id': doc_id,
+        'google_doc_url': doc_url,
+        'status': 'completed'
+    })
+    save_metadata(gcs_client, metadata)
+
+def run_pipeline(model, gcs_client, drive_service, folder_id, audio_files, metadata_by_file):
+    """Download, transcribe and publish all files; return how many are completed"""
+    total = len(audio_files)
+    pending = iter(enumerate(audio_files, 1))
+    in_flight = {}  # future -> (stage, index, file_info, metadata)
+    completed = 0
+    
+    with ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS) as download_pool, \
+         ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS) as transcribe_pool, \
+         ThreadPoolExecutor(max_workers=1) as publish_pool:  # Drive client is not thread-safe
+        
+        def fill():
+            """Start downloads until MAX_PREFETCH files hold decoded audio"""
+            nonlocal completed
+            while sum(stage != 'publish' for stage, *_ in in_flight.values()) < MAX_PREFETCH:
+                index, file_info = next(pending, (None, None))
+                if file_info is None:
+                    return
+                
+                metadata = metadata_by_file[file_info['filename']]
+                
+                # Check if already transcribed
+                if metadata.get('status') == 'completed' and 'google_doc_url' in metadata:
+                    print(f"⏭️ File {index}/{total} already transcribed: {metadata['google_doc_url']}")
+                    completed += 1
+                    continue
+                
+                print(f"📁 Queued file {index}/{total}: {file_info['filename']}")
+                future = download_pool.submit(download_audio, gcs_client, file_info['gcs_path'])
+                in_flight[future] = ('download', index, file_info, metadata)
+        
+        # Each file moves to its next stage as soon as the previous one finishes,
+        # so a long file never holds the other transcription worker idle
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, index, file_info, metadata = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Error processing {file_info['filename']}: {e}")
+                    continue
+                
+                if stage == 'download':
+                    next_future = transcribe_pool.submit(transcribe_audio, model, result, metadata)
+                    in_flight[next_future] = ('transcribe', index, file_info, metadata)
+                elif stage == 'transcribe':
+                    next_future = publish_pool.submit(
+                        publish_transcript, drive_service, gcs_client,
+                        folder_id, metadata, result
+                    )
+                    in_flight[next_future] = ('publish', index, file_info, metadata)
+                else:
+                    completed += 1
+                    print(f"✅ File {index}/{total} completed")
+            fill()
+    
+    return completed
+
 # ===== AUTO SHUTDOWN =====
 def shutdown_instance():
-    """Shutdown the instance automatically"""
-    print("💤 Auto-shutdown in 60 seconds... (Ctrl+C to cancel)")
-    try:
-        time.sleep(60)
-        print("🔌 Shutting down instance...")
-        subprocess.run(["sudo", "shutdown", "-h", "now"], check=True)
-    except KeyboardInterrupt:
-        print("❌ Auto-shutdown cancelled")
+    """Schedule instance shutdown and exit instead of sleeping until it happens"""
+    print("💤 Auto-shutdown in 60 seconds... (cancel with: sudo shutdown -c)")
+    subprocess.run(["sudo", "shutdown", "-h", "+1"], check=True)
+    sys.exit(0)
 
 # ===== MAIN FUNCTION =====
 def main():
     """Main transcription workflow"""
     print("🎙️ Custom Audio File Transcription")
     print("=" * 40)
-    print(f"Model: {WHISPER_MODEL}")
+    print(f"Model: {WHISPER_MODEL} on {WHISPER_DEVICE} ({COMPUTE_TYPE})")
+    if WHISPER_DEVICE == "cpu" and WHISPER_MODEL.startswith(GPU_MODELS):
+        print(f"⚠️ No CUDA device found - {WHISPER_MODEL} will be slow on CPU (use a g4dn/g5 instance)")
     print(f"Expected files: .m4a files from GCS")
     print()
     
     # Authenticate
     print("🔐 Authenticating with Google Cloud...")
-    drive_service, docs_service, gcs_client = authenticate()
+    drive_service, gcs_client = authenticate()
     
     # Setup infrastructure
     print("🏗️ Setting up storage...")
@@ -296,61 +433,16 @@ def main():
     
     print(f"\n🚀 Starting transcription of {len(audio_files)} files...")
     
-    # Create temp directory
-    TEMP_AUDIO_DIR.mkdir(exist_ok=True)
+    # Check existing metadata up front
+    print("🗂️ Loading existing metadata...")
+    metadata_by_file = load_all_metadata(gcs_client, audio_files)
     
-    # Process each file
-    completed = 0
-    for i, file_info in enumerate(audio_files, 1):
-        print(f"\n{'='*50}")
-        print(f"📁 Processing file {i}/{len(audio_files)}: {file_info['filename']}")
-        print(f"{'='*50}")
-        
-        try:
-            # Load/create metadata
-            metadata = load_metadata(gcs_client, file_info['filename'])
-            
-            # Check if already transcribed
-            if metadata.get('status') == 'completed' and 'google_doc_url' in metadata:
-                print(f"⏭️ Already transcribed: {metadata['google_doc_url']}")
-                completed += 1
-                continue
-            
-            # Download audio file
-            temp_audio_path = TEMP_AUDIO_DIR / file_info['filename']
-            download_audio_file(gcs_client, file_info['gcs_path'], temp_audio_path)
-            
-            # Transcribe
-            transcript = transcribe_audio(temp_audio_path, metadata)
-            
-            # Create Google Doc
-            doc_id, doc_url = create_google_doc(
-                docs_service, drive_service, folder_id, metadata, transcript
-            )
-            
-            # Update metadata with doc info
-            metadata.update({
-                'google_doc_id': doc_id,
-                'google_doc_url': doc_url,
-                'status': 'completed'
-            })
-            
-            # Save metadata
-            save_metadata(gcs_client, metadata)
-            
-            # Cleanup temp file
-            temp_audio_path.unlink()
-            
-            completed += 1
-            print(f"✅ File {i}/{len(audio_files)} completed")
-            
-        except Exception as e:
-            print(f"❌ Error processing {file_info['filename']}: {e}")
-            # Cleanup temp file if it exists
-            temp_audio_path = TEMP_AUDIO_DIR / file_info['filename']
-            if temp_audio_path.exists():
-                temp_audio_path.unlink()
-            continue
+    # Load model once and reuse it for every file
+    model = load_whisper_model()
+    
+    completed = run_pipeline(
+        model, gcs_client, drive_service, folder_id, audio_files, metadata_by_file
+    )
     
     # Final summary
     print(f"\n{'='*50}")
@@ -360,6 +452,10 @@ def main():
     print(f"📁 All transcripts saved to: {CUSTOM_FOLDER_NAME}")
     print(f"☁️ Metadata saved to: gs://{GCS_BUCKET_NAME}/{GCS_METADATA_PREFIX}")
     
+    # Release the model before the shutdown window
+    del model
+    gc.collect()
+    
     # Auto shutdown
     if completed > 0:
         shutdown_instance()
@@ -464,8 +560,12 @@ source transcription-env/bin/activate
 
 # Install Python packages
 pip install --upgrade pip setuptools wheel
-pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
-pip install openai-whisper google-api-python-client google-auth google-cloud-storage tqdm certifi
+pip install faster-whisper==1.1.1 nvidia-cublas-cu12 'nvidia-cudnn-cu12==9.*'
+pip install google-api-python-client google-auth 'google-cloud-storage>=2.14' tqdm certifi orjson
+
+# CTranslate2 4.x loads CUDA 12 cuBLAS/cuDNN 9 from the pip wheels above
+NVIDIA_LIBS=$HOME/transcription-env/lib/python3.12/site-packages/nvidia
+echo "export LD_LIBRARY_PATH=$NVIDIA_LIBS/cublas/lib:$NVIDIA_LIBS/cudnn/lib:\${LD_LIBRARY_PATH}" >> transcription-env/bin/activate
 
 # Install NVIDIA drivers
 sudo apt install -y ubuntu-drivers-common
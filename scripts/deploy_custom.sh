@@ -92,8 +92,12 @@ source transcription-env/bin/activate
 
 # Install Python packages
 pip install --upgrade pip setuptools wheel
-pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
-pip install openai-whisper google-api-python-client google-auth google-cloud-storage tqdm certifi
+pip install faster-whisper==1.1.1 nvidia-cublas-cu12 'nvidia-cudnn-cu12==9.*'
+pip install google-api-python-client google-auth 'google-cloud-storage>=2.14' tqdm certifi orjson
+
+# CTranslate2 4.x loads CUDA 12 cuBLAS/cuDNN 9 from the pip wheels above
+NVIDIA_LIBS=$HOME/transcription-env/lib/python3.12/site-packages/nvidia
+echo "export LD_LIBRARY_PATH=$NVIDIA_LIBS/cublas/lib:$NVIDIA_LIBS/cudnn/lib:\${LD_LIBRARY_PATH}" >> transcription-env/bin/activate
 
 # Install NVIDIA drivers
 sudo apt install -y ubuntu-drivers-common